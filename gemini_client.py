@@ -0,0 +1,217 @@
+"""
+Gemini API client used by the Streamlit app: a shared, retrying HTTP session
+and worker pool, request building, and response parsing. It has no Streamlit
+dependency, so it is imported once per process and everything set up here is
+reused across reruns and user sessions.
+"""
+import functools
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from urllib3.util.retry import Retry
+
+# orjson encodes/decodes the large grounded responses noticeably faster;
+# fall back to the standard library if it is not installed
+try:
+    import orjson
+
+    json_loads = orjson.loads
+    json_dumps = orjson.dumps
+except ImportError:
+    import json
+
+    json_loads = json.loads
+
+    def json_dumps(obj):
+        return json.dumps(obj, ensure_ascii=False).encode()
+
+# Google GenAI API endpoint details
+MODEL_NAME = "gemini-2.5-flash-preview-09-2025"
+API_URL = "https://generativelanguage.googleapis.com/v1beta/models/{model}:streamGenerateContent?alt=sse&key={key}"
+
+def build_api_url(api_key):
+    """
+    Returns the streaming endpoint URL for the configured model and API key.
+    """
+    return API_URL.format(model=MODEL_NAME, key=api_key)
+
+def _build_session():
+    """
+    Builds the HTTP session shared by all requests so the keep-alive TLS
+    connection is reused.
+    """
+    # Retry transient failures at the connection layer with jittered
+    # exponential backoff, honouring the server's Retry-After header
+    retry = Retry(
+        total=5,
+        backoff_factor=0.5,
+        backoff_jitter=0.3,
+        status_forcelist=(429, 500, 502, 503, 504),
+        respect_retry_after_header=True,
+        allowed_methods=frozenset(["POST"]),
+        raise_on_status=False,  # Hand the final error response back for reporting
+    )
+    session = requests.Session()
+    session.mount("https://", requests.adapters.HTTPAdapter(pool_connections=4, pool_maxsize=10, max_retries=retry))
+    # requests already advertises gzip/deflate (plus br when Brotli is
+    # installed) and merges that default into every request's headers
+    session.headers.update({"Content-Type": "application/json"})
+    return session
+
+SESSION = _build_session()
+
+# Worker pool that runs batch requests concurrently (see call_many)
+EXECUTOR = ThreadPoolExecutor(max_workers=4)
+
+@functools.lru_cache(maxsize=8)
+def get_payload_template(system_prompt):
+    """
+    Pre-serializes the invariant part of the request body (tools and system
+    instruction) once per system prompt. Returns the (prefix, suffix) bytes
+    that go around the JSON-encoded user query.
+    """
+    invariant = json_dumps({
+        "tools": [{"google_search": {} }],  # Enable Google Search grounding
+        "systemInstruction": {"parts": [{"text": system_prompt}]},
+    })
+    return b'{"contents":[{"parts":[{"text":', b'}]}],' + invariant[1:]
+
+def build_request_body(query, system_prompt):
+    """
+    Returns the JSON request body for a query, reusing the cached template.
+    """
+    prefix, suffix = get_payload_template(system_prompt)
+    return prefix + json_dumps(query) + suffix
+
+def _first_candidate(result):
+    """
+    Returns the first candidate of an API response, or None if there is none.
+    """
+    try:
+        candidate = result['candidates'][0]
+    except (KeyError, IndexError, TypeError):
+        return None
+    return candidate if isinstance(candidate, dict) else None
+
+def _parts(candidate):
+    """
+    Returns the content parts of a candidate, or an empty tuple if there are none.
+    """
+    try:
+        return candidate['content']['parts']
+    except (KeyError, TypeError):
+        return ()
+
+def stream_gemini(query, system_prompt, api_url, result):
+    """
+    Calls the Gemini API with Google Search grounding enabled and yields the
+    answer text as it streams in. Transient failures are retried by the shared
+    session, and closing the generator early closes the connection.
+
+    Once the stream completes, `result` is filled with the assembled response
+    in the usual (non-streamed) shape. Raises
+    requests.exceptions.RequestException if the request fails.
+    """
+    with SESSION.post(
+        api_url,
+        data=build_request_body(query, system_prompt),
+        stream=True,
+        timeout=45 # High timeout to prevent server failure on slow response
+    ) as response:
+        if not response.ok:
+            response.content  # Read the error body before the stream is closed
+        response.raise_for_status()
+
+        candidate_seen = False
+        text_parts = []
+        grounding_metadata = {}
+        for line in response.iter_lines():
+            # Server-sent events: each payload line is "data: <json chunk>"
+            if not line.startswith(b"data: "):
+                continue
+            try:
+                chunk = json_loads(line[6:])
+            except ValueError as e:
+                # Surface malformed/truncated chunks as a request failure, as response.json() did
+                raise requests.exceptions.InvalidJSONError(f"Malformed response chunk: {e}", response=response) from e
+            candidate = _first_candidate(chunk)
+            if candidate is None:
+                continue
+            candidate_seen = True
+            for part in _parts(candidate):
+                if isinstance(part, dict) and part.get('text'):
+                    text_parts.append(part['text'])
+                    yield part['text']
+            # Grounding metadata arrives with the final chunk(s)
+            grounding_metadata = candidate.get('groundingMetadata') or grounding_metadata
+
+    # Keep a candidate without text (e.g. a blocked answer) so that
+    # extract_and_format_response can report it and still list its sources
+    result['candidates'] = [{
+        'content': {'parts': [{'text': "".join(text_parts)}] if text_parts else []},
+        'groundingMetadata': grounding_metadata,
+    }] if candidate_seen else []
+
+def call_gemini(query, system_prompt, api_url):
+    """
+    Calls the Gemini API and returns the assembled response once the whole
+    answer has arrived. Raises requests.exceptions.RequestException if the
+    request fails.
+    """
+    result = {}
+    for _ in stream_gemini(query, system_prompt, api_url, result):
+        pass
+    return result
+
+def call_many(queries, system_prompt, api_url):
+    """
+    Calls the Gemini API for several queries concurrently on the shared worker
+    pool, which also caps how many requests are in flight at once.
+
+    Returns one entry per query, in order: the assembled response, or the
+    requests.exceptions.RequestException raised for that query.
+    """
+    futures = [EXECUTOR.submit(call_gemini, query, system_prompt, api_url) for query in queries]
+    results = []
+    for future in futures:
+        try:
+            results.append(future.result())
+        except requests.exceptions.RequestException as e:
+            results.append(e)
+    return results
+
+def has_answer_text(result):
+    """
+    Returns True when the response carries generated text worth caching.
+    """
+    candidate = _first_candidate(result)
+    return candidate is not None and bool(_parts(candidate))
+
+def extract_and_format_response(result):
+    """
+    Extracts the text and source citations from the Gemini API response.
+    """
+    candidate = _first_candidate(result)
+    if candidate is None:
+        return "⚠️ Received an empty or invalid response from the API.", ()
+
+    try:
+        generated_text = _parts(candidate)[0]['text']
+    except (KeyError, IndexError, TypeError):
+        generated_text = 'No text generated.'
+
+    # Extract grounding sources
+    try:
+        attributions = candidate['groundingMetadata']['groundingAttributions'] or ()
+    except (KeyError, TypeError):
+        attributions = ()
+    # A tuple of (title, uri) tuples is cheaper to cache than a list of dicts
+    sources = tuple(
+        (web_info['title'], web_info['uri'])
+        for attribution in attributions
+        if isinstance(attribution, dict)
+        and isinstance(web_info := attribution.get('web'), dict)
+        and web_info.get('uri') and web_info.get('title')
+    )
+
+    return generated_text, sources
@@ -1,97 +1,291 @@
 import streamlit as st
 import requests
-import json
 import os
-import time # Ensure time is imported for sleep
+import hashlib
+import threading
+import time
+import uuid
+from contextlib import closing
+from types import SimpleNamespace
+import diskcache
+from cachetools import TTLCache
+from dotenv import load_dotenv
+from gemini_client import build_api_url, call_many, extract_and_format_response, has_answer_text, stream_gemini
 
 # --- Configuration ---
 
-# We assume API_KEY is set via Streamlit Secrets
-API_KEY = st.secrets.get("GOOGLE_API_KEY")
+@st.cache_resource
+def get_config():
+    """
+    Reads the API key once per process instead of re-parsing the secrets on
+    every rerun. We assume GOOGLE_API_KEY is set via Streamlit Secrets, with
+    an environment variable (or the local .env file) as a fallback.
+    """
+    try:
+        api_key = st.secrets.get("GOOGLE_API_KEY")
+    except FileNotFoundError:  # No secrets.toml, e.g. when running locally
+        api_key = None
+
+    if not api_key:
+        load_dotenv()
+        api_key = os.getenv("GOOGLE_API_KEY")
+
+    if not api_key:
+        st.error("🚨 Configuration Error: GOOGLE_API_KEY not found in Streamlit Secrets or the environment.")
+        st.stop()
+
+    return SimpleNamespace(key=api_key, url=build_api_url(api_key))
+
+# Stop straight away if the key is missing
+get_config()
 
-if not API_KEY:
-    st.error("🚨 Configuration Error: GOOGLE_API_KEY not found in Streamlit Secrets.")
-    st.stop()
-    
 # For debugging: Log confirmation that the key is loaded (though value is hidden)
 st.session_state.get('api_key_status', st.warning("Key Check: API Key is configured and loaded securely."))
 
-# Google GenAI API endpoint details
-MODEL_NAME = "gemini-2.5-flash-preview-09-2025"
-API_URL = f"https://generativelanguage.googleapis.com/v1beta/models/{MODEL_NAME}:generateContent?key={API_KEY}"
-
 # --- Rate Limiting Setup ---
-MAX_CALLS_PER_SESSION = 5
-CALL_COUNT_KEY = 'api_call_count'
+RATE_LIMIT_CALLS = 20  # Searches allowed per client...
+RATE_LIMIT_PERIOD_SECONDS = 60  # ...refilled evenly over this period
+RATE_LIMIT_MAX_CLIENTS = 4096  # Clients tracked before fully refilled buckets are pruned
+# Number of reverse proxies in front of the app (Streamlit Community Cloud has
+# one). The client is the address that many hops from the right of
+# X-Forwarded-For; set to 0 to use the socket peer address only.
+TRUSTED_PROXY_HOPS = 1
+
+class TokenBucket:
+    """
+    Allows `rate` calls per `per` seconds, refilling continuously.
+    Safe to share between the threads of concurrent user sessions.
+    """
+    def __init__(self, rate, per):
+        self.tokens = rate
+        self.rate = rate
+        self.per = per
+        self.last = time.monotonic()
+        self.lock = threading.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.rate, self.tokens + (now - self.last) * self.rate / self.per)
+        self.last = now
+
+    def acquire(self):
+        """
+        Takes one token if available. Returns False when the caller is rate limited.
+        """
+        with self.lock:
+            self._refill()
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return True
+            return False
+
+    def remaining(self):
+        """
+        Returns the number of whole tokens currently available.
+        """
+        with self.lock:
+            self._refill()
+            return int(self.tokens)
+
+    def is_full(self):
+        """
+        Returns True once the bucket has refilled completely.
+        """
+        with self.lock:
+            self._refill()
+            return self.tokens >= self.rate
+
+@st.cache_resource
+def get_rate_limiters():
+    """
+    Returns the process-wide per-client token buckets and the lock guarding them.
+    """
+    return {}, threading.Lock()
 
-# Initialize session state for the call count
-if CALL_COUNT_KEY not in st.session_state:
-    st.session_state[CALL_COUNT_KEY] = 0
+def _client_id():
+    """
+    Identifies the current client for rate limiting.
+
+    Behind a reverse proxy the socket peer is the proxy itself, so the address
+    added by the nearest trusted proxy to X-Forwarded-For is used instead. When
+    no address is known (e.g. on localhost) each browser session gets its own id.
+    """
+    if TRUSTED_PROXY_HOPS:
+        forwarded = [hop.strip() for hop in (st.context.headers.get("X-Forwarded-For") or "").split(",") if hop.strip()]
+        if len(forwarded) >= TRUSTED_PROXY_HOPS:
+            return forwarded[-TRUSTED_PROXY_HOPS]
+    if st.context.ip_address:
+        return st.context.ip_address
+    return st.session_state.setdefault('rate_limit_client_id', uuid.uuid4().hex)
+
+def get_rate_limiter():
+    """
+    Returns the token bucket for the current client. Unlike a session_state
+    counter, it is not reset by refreshing the page.
+    """
+    client_id = _client_id()
+    buckets, lock = get_rate_limiters()
+    with lock:
+        bucket = buckets.get(client_id)
+        if bucket is None:
+            if len(buckets) >= RATE_LIMIT_MAX_CLIENTS:
+                # Only forget clients whose bucket has refilled completely;
+                # dropping one that still owes tokens would reset its quota
+                for idle_client in [key for key, idle in buckets.items() if idle.is_full()]:
+                    del buckets[idle_client]
+            bucket = buckets[client_id] = TokenBucket(RATE_LIMIT_CALLS, RATE_LIMIT_PERIOD_SECONDS)
+    return bucket
 
 # --- Helper Functions ---
 
-def generate_grounded_content(query, system_prompt):
-    """
-    Calls the Gemini API with Google Search grounding enabled.
-    Includes robust error handling and simplified backoff.
-    """
-    payload = {
-        "contents": [{"parts": [{"text": query}]}],
-        "tools": [{"google_search": {} }],  # Enable Google Search grounding
-        "systemInstruction": {"parts": [{"text": system_prompt}]},
-    }
-
-    # Simplified backoff logic for Streamlit for faster failure/feedback
-    for attempt in range(3):
-        try:
-            response = requests.post(
-                API_URL,
-                headers={"Content-Type": "application/json"},
-                data=json.dumps(payload),
-                timeout=45 # High timeout to prevent server failure on slow response
-            )
-            response.raise_for_status() 
-            return response.json()
-
-        except requests.exceptions.HTTPError as e:
-            # Handle specific API errors like 400 (Bad Request) or 429 (Quota)
-            st.error(f"❌ API Error (HTTP Status {response.status_code}): {response.text}")
-            return None
-        
-        except requests.exceptions.RequestException as e:
-            # Handle network/timeout errors
-            if attempt < 2:
-                st.warning(f"Connection attempt {attempt + 1} failed. Retrying in {2 ** attempt}s...")
-                time.sleep(2 ** attempt)
+def generate_grounded_content(query, system_prompt, result):
+    """
+    Yields the grounded answer text as it streams in from the Gemini API and
+    reports request failures. Once the stream completes, `result` is filled
+    with the assembled response. If Streamlit stops the script mid-stream,
+    closing this generator also closes the API connection.
+    """
+    try:
+        yield from stream_gemini(query, system_prompt, get_config().url, result)
+    except requests.exceptions.RequestException as e:
+        show_request_error(e)
+
+def show_request_error(error):
+    """
+    Shows a failed API request to the user.
+    """
+    if isinstance(error, requests.exceptions.HTTPError):
+        # Handle specific API errors like 400 (Bad Request) or 429 (Quota)
+        st.error(f"❌ API Error (HTTP Status {error.response.status_code}): {error.response.text}")
+    else:
+        # Handle network/timeout errors once the session's retries are exhausted
+        st.error(f"❌ Critical Network Failure: Request failed after multiple retries. Please check the network connection. Error: {error}")
+
+def show_sources(sources):
+    """
+    Lists the grounding sources of an answer, or warns that there are none.
+    """
+    if sources:
+        st.markdown("### 📚 Grounding Sources")
+        for i, (title, uri) in enumerate(sources):
+            st.markdown(f"**{i+1}.** [{title}]({uri})")
+    else:
+        st.warning("No specific grounding sources were found for this query.")
+
+def run_batch(queries, system_prompt):
+    """
+    Answers several queries at once. Repeated queries are answered once and
+    cached answers are reused; the rest are sent to the API concurrently, each
+    consuming one search from the rate limit.
+    """
+    unique_queries = {}
+    for query in queries:
+        unique_queries.setdefault(_cache_key(query, system_prompt), query)
+    queries = list(unique_queries.values())
+
+    answers = [get_cached_answer(query, system_prompt) for query in queries]
+    limiter = get_rate_limiter()
+    pending = [i for i, answer in enumerate(answers) if answer is None and limiter.acquire()]
+
+    errors = {}
+    with st.spinner(f"Searching the web for {len(pending)} queries..."):
+        results = call_many([queries[i] for i in pending], system_prompt, get_config().url)
+    for i, result in zip(pending, results):
+        if isinstance(result, Exception):
+            errors[i] = result
+        elif result['candidates']:
+            answers[i] = extract_and_format_response(result)
+            if has_answer_text(result):
+                cache_answer(queries[i], system_prompt, answers[i])
+
+    for i, query in enumerate(queries):
+        with st.expander(f"**{i+1}.** {query}", expanded=True):
+            if answers[i]:
+                st.info(answers[i][0])
+                show_sources(answers[i][1])
+            elif i in errors:
+                show_request_error(errors[i])
+            elif i in pending:
+                st.error("⚠️ The API returned an empty or unparsable response. This is likely an internal API or server issue.")
             else:
-                st.error(f"❌ Critical Network Failure: Request failed after multiple retries. Please check the network connection. Error: {e}")
-                return None
-    return None
-
-def extract_and_format_response(result):
-    """
-    Extracts the text and source citations from the Gemini API response.
-    """
-    if not result or 'candidates' not in result or not result['candidates']:
-        st.error("⚠️ The API returned an empty or unparsable response. This is likely an internal API or server issue.")
-        return "⚠️ Received an empty or invalid response from the API.", []
-
-    candidate = result['candidates'][0]
-    generated_text = candidate.get('content', {}).get('parts', [{}])[0].get('text', 'No text generated.')
-    sources = []
-
-    # Extract grounding sources
-    grounding_metadata = candidate.get('groundingMetadata', {})
-    if grounding_metadata and grounding_metadata.get('groundingAttributions'):
-        for attribution in grounding_metadata['groundingAttributions']:
-            web_info = attribution.get('web')
-            if web_info and web_info.get('uri') and web_info.get('title'):
-                sources.append({
-                    'title': web_info['title'],
-                    'uri': web_info['uri']
-                })
-    
-    return generated_text, sources
+                st.warning("⚠️ **Rate Limit Exceeded:** This query was skipped because you have used all of your searches for now.")
+
+# --- Response Cache Setup ---
+CACHE_TTL_SECONDS = 24 * 60 * 60  # Keep grounded answers reasonably fresh
+CACHE_MAX_ENTRIES = 256
+DISK_CACHE_DIR = ".gemini_cache"
+DISK_CACHE_SIZE_LIMIT = 2 ** 30  # 1 GiB
+DISK_CACHE_VERSION = "2"  # Bump when the cached answer format changes
+
+@st.cache_resource
+def get_response_cache():
+    """
+    Returns a process-wide store of answered queries, shared by all user sessions.
+    Entries expire after CACHE_TTL_SECONDS and the oldest are evicted past
+    CACHE_MAX_ENTRIES. TTLCache is not thread-safe, so it comes with a lock.
+    Each entry is stored with its absolute expiry time so that answers copied
+    in from the disk cache never outlive their original TTL.
+    """
+    return TTLCache(maxsize=CACHE_MAX_ENTRIES, ttl=CACHE_TTL_SECONDS), threading.Lock()
+
+@st.cache_resource
+def get_disk_cache():
+    """
+    Returns the on-disk answer cache, which survives restarts and redeploys
+    and is shared between processes. It backs the in-process cache above.
+    """
+    return diskcache.Cache(DISK_CACHE_DIR, size_limit=DISK_CACHE_SIZE_LIMIT)
+
+def _cache_key(query, system_prompt):
+    # Collapse whitespace and case so trivially different spellings share one entry.
+    # The API key is deliberately not part of the key, so rotating it keeps the cache.
+    return (" ".join(query.split()).casefold(), system_prompt)
+
+def _disk_cache_key(key):
+    """
+    Returns a fixed-length, versioned disk cache key for a cache key tuple.
+    """
+    return hashlib.blake2b("|".join((DISK_CACHE_VERSION, *key)).encode()).hexdigest()
+
+def get_cached_answer(query, system_prompt):
+    """
+    Returns the cached (text, sources) answer for a query, or None.
+    Checks the in-process cache first, then falls back to the disk cache.
+    """
+    key = _cache_key(query, system_prompt)
+    cache, lock = get_response_cache()
+    with lock:
+        entry = cache.get(key)
+    if entry is not None and entry[1] > time.time():
+        return entry[0]
+
+    answer, expire_at = get_disk_cache().get(_disk_cache_key(key), expire_time=True)
+    if answer is not None:
+        with lock:
+            cache[key] = (answer, expire_at)
+    return answer
+
+def cache_answer(query, system_prompt, answer):
+    """
+    Stores an answer in both cache tiers with the same expiry time.
+    """
+    key = _cache_key(query, system_prompt)
+    cache, lock = get_response_cache()
+    with lock:
+        cache[key] = (answer, time.time() + CACHE_TTL_SECONDS)
+    get_disk_cache().set(_disk_cache_key(key), answer, expire=CACHE_TTL_SECONDS)
+
+def show_remaining_searches(slot):
+    """
+    Draws the current client's rate-limit status into the sidebar placeholder.
+    """
+    remaining_calls = get_rate_limiter().remaining()
+    with slot.container():
+        if remaining_calls > 0:
+            st.success(f"Searches Remaining: {remaining_calls} / {RATE_LIMIT_CALLS}")
+        else:
+            st.error(f"Search Limit Reached: {RATE_LIMIT_CALLS} / {RATE_LIMIT_CALLS}")
+            st.info("Searches refill gradually. Please try again shortly.")
 
 # --- Streamlit UI and Logic ---
 
@@ -108,14 +302,9 @@ st.markdown("Ask any question to get an up-to-date answer backed by Google Searc
 with st.sidebar:
     st.header("App Status")
     
-    # Display rate limit status
-    remaining_calls = MAX_CALLS_PER_SESSION - st.session_state[CALL_COUNT_KEY]
-    
-    if remaining_calls > 0:
-        st.success(f"Searches Remaining: {remaining_calls} / {MAX_CALLS_PER_SESSION}")
-    else:
-        st.error(f"Daily Limit Reached: {MAX_CALLS_PER_SESSION} / {MAX_CALLS_PER_SESSION}")
-        st.info("Please refresh the app to start a new session.")
+    # Display rate limit status; the placeholder is refreshed after a search
+    quota_slot = st.empty()
+    show_remaining_searches(quota_slot)
 
     st.markdown("---")
     st.caption("Powered by Google Gemini API.")
@@ -134,37 +323,46 @@ system_prompt = (
 # Main input form
 with st.form("search_form"):
     user_query = st.text_area("Enter your search query:", placeholder="e.g., What are the latest developments in fusion energy as of today?", height=100)
+    batch_mode = st.checkbox("Batch mode: answer each line as a separate query")
     submitted = st.form_submit_button("Search for Grounded Answer")
 
 if submitted and user_query:
     st.subheader("Results")
     
-    # Check rate limit BEFORE proceeding
-    if st.session_state[CALL_COUNT_KEY] >= MAX_CALLS_PER_SESSION:
-        st.warning("⚠️ **Rate Limit Exceeded:** You have reached the maximum number of searches for this session. Please refresh the page to try again.")
+    if batch_mode:
+        run_batch([line.strip() for line in user_query.splitlines() if line.strip()], system_prompt)
+
+    # Cached answers are free; otherwise check (and consume) the rate limit BEFORE proceeding
+    elif (answer := get_cached_answer(user_query, system_prompt)) is None and not get_rate_limiter().acquire():
+        st.warning("⚠️ **Rate Limit Exceeded:** You have used all of your searches for now. Please try again shortly.")
     else:
-        # Increment call count
-        st.session_state[CALL_COUNT_KEY] += 1
-        
         with st.spinner("Searching the web and generating content..."):
             
-            # Make the API call
-            api_result = generate_grounded_content(user_query, system_prompt)
-            
-            if api_result:
-                # Extract and format the response
-                generated_text, sources = extract_and_format_response(api_result)
-
-                # Display the main answer
-                st.markdown("### 💡 AI Generated Answer")
-                st.info(generated_text)
-
-                # Display sources if available
-                if sources:
-                    st.markdown("### 📚 Grounding Sources")
-                    for i, source in enumerate(sources):
-                        st.markdown(f"**{i+1}.** [{source['title']}]({source['uri']})")
-                else:
-                    st.warning("No specific grounding sources were found for this query.")
-            
-            # The app will naturally rerun and update the sidebar count on the next interaction.
+            st.markdown("### 💡 AI Generated Answer")
+
+            # Reuse the cached answer, otherwise stream a fresh one from the API
+            answer_slot = st.empty()
+            if answer:
+                answer_slot.info(answer[0])
+            else:
+                api_result = {}
+                streamed_text = ""
+                # closing() ends the API stream at once if Streamlit stops the script mid-answer
+                with closing(generate_grounded_content(user_query, system_prompt, api_result)) as stream:
+                    for text in stream:
+                        streamed_text += text
+                        answer_slot.info(streamed_text)
+                if api_result.get('candidates'):
+                    answer = extract_and_format_response(api_result)
+                    answer_slot.info(answer[0])
+                    # Only cache real answers, never a candidate without text
+                    if has_answer_text(api_result):
+                        cache_answer(user_query, system_prompt, answer)
+                elif api_result:
+                    st.error("⚠️ The API returned an empty or unparsable response. This is likely an internal API or server issue.")
+
+            if answer:
+                show_sources(answer[1])
+
+    # Update the sidebar count in this same run rather than on the next interaction
+    show_remaining_searches(quota_slot)